@@ -7,51 +7,96 @@ Generates Speedup and Efficiency plots required for the report
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+import functools
+from concurrent.futures import ProcessPoolExecutor
 import os
 import sys
 
+# Optional: Polars >= 0.19 for compute_metrics (pandas otherwise)
+try:
+    import polars as pl
+    HAVE_POLARS = True
+except ImportError:
+    HAVE_POLARS = False
+
+# Columns used by the analysis; everything else stays on disk
+RESULT_COLUMNS = ['IMAGE_SIZE', 'MODE', 'THREADS', 'AVG_TIME_MS', 'GFLOPS']
+
+def _ensure_parquet(csv_path):
+    """Convert a results CSV to a Parquet sidecar, refreshing it when the CSV is newer"""
+    pq_path = os.path.splitext(csv_path)[0] + '.parquet'
+    if not os.path.exists(pq_path) or os.path.getmtime(pq_path) < os.path.getmtime(csv_path):
+        pd.read_csv(csv_path).to_parquet(pq_path, index=False)
+    return pq_path
+
+@functools.lru_cache(maxsize=None)
+def _read_results_cached(path, mtime):
+    """Load results once per (path, mtime), reading only RESULT_COLUMNS"""
+    try:
+        return pd.read_parquet(_ensure_parquet(path), columns=RESULT_COLUMNS)
+    except ImportError:
+        # No Parquet engine (pyarrow) installed; fall back to CSV
+        return pd.read_csv(path, usecols=RESULT_COLUMNS)
+
 def load_results(csv_file):
     """Load benchmark results from CSV"""
     if not os.path.exists(csv_file):
         print(f"Error: {csv_file} not found. Run benchmark.sh first.")
         sys.exit(1)
-    return pd.read_csv(csv_file)
+    return _read_results_cached(csv_file, os.path.getmtime(csv_file))
+
+# Output columns of compute_metrics and their dtypes
+METRIC_DTYPES = {
+    'IMAGE_SIZE': 'int32',
+    'THREADS': 'int32',
+    'SEQ_TIME': 'float32',
+    'PARALLEL_TIME': 'float32',
+    'SPEEDUP': 'float32',
+    'EFFICIENCY': 'float32',
+    'GFLOPS': 'float32'
+}
+
+def _compute_metrics_polars(df):
+    """compute_metrics as Polars expressions over the loaded results (row order is not kept; main() sorts)"""
+    lf = pl.DataFrame({col: df[col].to_numpy() for col in RESULT_COLUMNS}).lazy()
+    seq = (lf.filter(pl.col('MODE') == 'SEQ')
+           .unique(subset='IMAGE_SIZE', keep='first', maintain_order=True)
+           .select('IMAGE_SIZE', pl.col('AVG_TIME_MS').alias('SEQ_TIME')))
+    m = (lf.filter(pl.col('MODE') == 'OMP')
+         .join(seq, on='IMAGE_SIZE')
+         .rename({'AVG_TIME_MS': 'PARALLEL_TIME'})
+         .with_columns((pl.col('SEQ_TIME') / pl.col('PARALLEL_TIME')).alias('SPEEDUP'))
+         .with_columns((pl.col('SPEEDUP') / pl.col('THREADS')).alias('EFFICIENCY'))
+         .select(list(METRIC_DTYPES))
+         .collect())
+    
+    return pd.DataFrame({col: m[col].to_numpy() for col in METRIC_DTYPES}).astype(METRIC_DTYPES)
 
 def compute_metrics(df):
     """Compute Speedup and Efficiency"""
-    results = []
+    if HAVE_POLARS:
+        return _compute_metrics_polars(df)
     
-    for size in df['IMAGE_SIZE'].unique():
-        size_data = df[df['IMAGE_SIZE'] == size].copy()
-        
-        # Get sequential baseline time
-        seq_time = size_data[size_data['MODE'] == 'SEQ']['AVG_TIME_MS'].values[0]
-        
-        for _, row in size_data[size_data['MODE'] == 'OMP'].iterrows():
-            parallel_time = row['AVG_TIME_MS']
-            threads = int(row['THREADS'])
-            
-            speedup = seq_time / parallel_time
-            efficiency = speedup / threads
-            
-            results.append({
-                'IMAGE_SIZE': size,
-                'THREADS': threads,
-                'SEQ_TIME': seq_time,
-                'PARALLEL_TIME': parallel_time,
-                'SPEEDUP': speedup,
-                'EFFICIENCY': efficiency,
-                'GFLOPS': row['GFLOPS']
-            })
-    
-    return pd.DataFrame(results)
+    # Sequential baseline per image size, joined onto every OMP row
+    seq = (df[df['MODE'] == 'SEQ'][['IMAGE_SIZE', 'AVG_TIME_MS']]
+           .drop_duplicates('IMAGE_SIZE')
+           .rename(columns={'AVG_TIME_MS': 'SEQ_TIME'}))
+    omp = df[df['MODE'] == 'OMP']
+    
+    m = omp.merge(seq, on='IMAGE_SIZE').rename(columns={'AVG_TIME_MS': 'PARALLEL_TIME'})
+    m['SPEEDUP'] = m['SEQ_TIME'] / m['PARALLEL_TIME']
+    m['EFFICIENCY'] = m['SPEEDUP'] / m['THREADS']
+    
+    return m[list(METRIC_DTYPES)].astype(METRIC_DTYPES)
+
+# Columns read by the plot functions
+PLOT_COLUMNS = ['IMAGE_SIZE', 'THREADS', 'PARALLEL_TIME', 'SPEEDUP', 'EFFICIENCY']
 
 def plot_speedup(metrics):
     """Generate Speedup vs Threads plot"""
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig, ax = plt.subplots(figsize=(10, 6), constrained_layout=True)
     
-    for size in metrics['IMAGE_SIZE'].unique():
-        size_data = metrics[metrics['IMAGE_SIZE'] == size].sort_values('THREADS')
+    for size, size_data in metrics.groupby('IMAGE_SIZE'):
         ax.plot(size_data['THREADS'], size_data['SPEEDUP'], 
                 marker='o', linewidth=2, markersize=8, label=f'N={size}')
     
@@ -67,16 +112,15 @@ def plot_speedup(metrics):
     ax.legend(fontsize=11)
     ax.set_xticks([1, 2, 4, 8])
     
-    plt.tight_layout()
-    plt.savefig('plots/speedup_vs_threads.png', dpi=300, bbox_inches='tight')
+    fig.savefig('plots/speedup_vs_threads.png', dpi=200)
+    plt.close(fig)
     print("✓ Saved: plots/speedup_vs_threads.png")
 
 def plot_efficiency(metrics):
     """Generate Efficiency vs Threads plot"""
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig, ax = plt.subplots(figsize=(10, 6), constrained_layout=True)
     
-    for size in metrics['IMAGE_SIZE'].unique():
-        size_data = metrics[metrics['IMAGE_SIZE'] == size].sort_values('THREADS')
+    for size, size_data in metrics.groupby('IMAGE_SIZE'):
         ax.plot(size_data['THREADS'], size_data['EFFICIENCY'], 
                 marker='s', linewidth=2, markersize=8, label=f'N={size}')
     
@@ -94,17 +138,16 @@ def plot_efficiency(metrics):
     ax.set_xticks([1, 2, 4, 8])
     ax.set_ylim([0, 1.1])
     
-    plt.tight_layout()
-    plt.savefig('plots/efficiency_vs_threads.png', dpi=300, bbox_inches='tight')
+    fig.savefig('plots/efficiency_vs_threads.png', dpi=200)
+    plt.close(fig)
     print("✓ Saved: plots/efficiency_vs_threads.png")
 
 def plot_scaling_analysis(metrics):
     """Generate strong and weak scaling plot"""
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5), constrained_layout=True)
     
     # Strong Scaling (fixed image size, varying threads)
-    for size in metrics['IMAGE_SIZE'].unique():
-        size_data = metrics[metrics['IMAGE_SIZE'] == size].sort_values('THREADS')
+    for size, size_data in metrics.groupby('IMAGE_SIZE'):
         ax1.plot(size_data['THREADS'], size_data['PARALLEL_TIME'], 
                 marker='o', linewidth=2, markersize=8, label=f'N={size}')
     
@@ -116,9 +159,8 @@ def plot_scaling_analysis(metrics):
     ax1.set_xticks([1, 2, 4, 8])
     
     # Execution time vs Image size (different thread counts)
-    sizes = sorted(metrics['IMAGE_SIZE'].unique())
     for threads in [1, 2, 4, 8]:
-        thread_data = metrics[metrics['THREADS'] == threads].sort_values('IMAGE_SIZE')
+        thread_data = metrics[metrics['THREADS'] == threads]
         if len(thread_data) > 0:
             ax2.plot(thread_data['IMAGE_SIZE'], thread_data['PARALLEL_TIME'],
                     marker='s', linewidth=2, markersize=8, label=f'{threads} threads')
@@ -129,8 +171,8 @@ def plot_scaling_analysis(metrics):
     ax2.grid(True, alpha=0.3)
     ax2.legend(fontsize=10)
     
-    plt.tight_layout()
-    plt.savefig('plots/scaling_analysis.png', dpi=300, bbox_inches='tight')
+    fig.savefig('plots/scaling_analysis.png', dpi=200)
+    plt.close(fig)
     print("✓ Saved: plots/scaling_analysis.png")
 
 def generate_report_table(metrics):
@@ -139,10 +181,9 @@ def generate_report_table(metrics):
     print("Performance Summary Table")
     print("="*80)
     
-    for size in sorted(metrics['IMAGE_SIZE'].unique()):
+    for size, size_data in metrics.groupby('IMAGE_SIZE'):
         print(f"\nImage Size: {size}x{size}")
         print("-" * 70)
-        size_data = metrics[metrics['IMAGE_SIZE'] == size].sort_values('THREADS')
         
         print(f"{'Threads':<10} {'Time(ms)':<12} {'Speedup':<12} {'Efficiency':<12} {'GFLOPS':<10}")
         print("-" * 70)
@@ -166,17 +207,22 @@ def main():
     df = load_results('benchmark_results.csv')
     metrics = compute_metrics(df)
     
-    # Generate visualizations
+    # Sort once; plots and the report table rely on this order
+    metrics = metrics.sort_values(['IMAGE_SIZE', 'THREADS']).reset_index(drop=True)
+    
+    # Generate visualizations (independent renders, one process each)
     print("Generating plots...")
-    plot_speedup(metrics)
-    plot_efficiency(metrics)
-    plot_scaling_analysis(metrics)
+    plot_data = metrics[PLOT_COLUMNS]
+    plotters = [plot_speedup, plot_efficiency, plot_scaling_analysis]
+    with ProcessPoolExecutor(max_workers=len(plotters)) as executor:
+        for future in [executor.submit(plot, plot_data) for plot in plotters]:
+            future.result()
     
     # Generate report table
     generate_report_table(metrics)
     
     # Save metrics to CSV for report
-    metrics.to_csv('plots/performance_metrics.csv', index=False)
+    metrics.to_csv('plots/performance_metrics.csv', index=False, float_format='%.6g')
     print("\n✓ Saved: plots/performance_metrics.csv")
     
     print("\n" + "="*80)
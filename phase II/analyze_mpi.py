@@ -7,26 +7,43 @@ Analyzes strong scaling, weak scaling, and latency/bandwidth results
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+import functools
 import os
 import sys
+import warnings
+
+def _ensure_parquet(csv_path):
+    """Convert a results CSV to a Parquet sidecar, refreshing it when the CSV is newer"""
+    pq_path = os.path.splitext(csv_path)[0] + '.parquet'
+    if not os.path.exists(pq_path) or os.path.getmtime(pq_path) < os.path.getmtime(csv_path):
+        pd.read_csv(csv_path).to_parquet(pq_path, index=False)
+    return pq_path
+
+@functools.lru_cache(maxsize=None)
+def _read_results_cached(path, mtime):
+    """Load results once per (path, mtime)"""
+    try:
+        return pd.read_parquet(_ensure_parquet(path))
+    except ImportError:
+        # No Parquet engine (pyarrow) installed; fall back to CSV
+        return pd.read_csv(path)
 
 def load_scaling_results(csv_file):
     """Load scaling benchmark results"""
     if not os.path.exists(csv_file):
         print(f"Warning: {csv_file} not found")
         return None
-    return pd.read_csv(csv_file)
+    return _read_results_cached(csv_file, os.path.getmtime(csv_file))
 
 def plot_strong_scaling(df):
     """Generate strong scaling plot"""
     if df is None or df.empty:
         return
     
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5), constrained_layout=True)
     
     # Plot 1: Speedup vs Processes
-    for size in df['IMAGE_SIZE'].unique():
-        size_data = df[df['IMAGE_SIZE'] == size].sort_values('PROCESSES')
+    for size, size_data in df.groupby('IMAGE_SIZE'):
         ax1.plot(size_data['PROCESSES'], size_data['SPEEDUP'], 
                 marker='o', linewidth=2, markersize=8, label=f'N={size}')
     
@@ -42,8 +59,7 @@ def plot_strong_scaling(df):
     ax1.set_xticks(processes)
     
     # Plot 2: Efficiency vs Processes
-    for size in df['IMAGE_SIZE'].unique():
-        size_data = df[df['IMAGE_SIZE'] == size].sort_values('PROCESSES')
+    for size, size_data in df.groupby('IMAGE_SIZE'):
         ax2.plot(size_data['PROCESSES'], size_data['EFFICIENCY'], 
                 marker='s', linewidth=2, markersize=8, label=f'N={size}')
     
@@ -59,8 +75,8 @@ def plot_strong_scaling(df):
     ax2.set_xticks(processes)
     ax2.set_ylim([0, 1.1])
     
-    plt.tight_layout()
-    plt.savefig('plots/strong_scaling.png', dpi=300, bbox_inches='tight')
+    fig.savefig('plots/strong_scaling.png', dpi=200)
+    plt.close(fig)
     print("✓ Saved: plots/strong_scaling.png")
 
 def plot_weak_scaling(df):
@@ -68,14 +84,14 @@ def plot_weak_scaling(df):
     if df is None or df.empty:
         return
     
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5), constrained_layout=True)
     
-    # Prepare data
-    df_sorted = df.sort_values('PROCESSES')
-    baseline_time = df_sorted.iloc[0]['AVG_TIME_MS']
+    # Prepare data (df is sorted by PROCESSES in main)
+    baseline_time = df.iloc[0]['AVG_TIME_MS']
+    processes = df['PROCESSES'].unique()
     
     # Plot 1: Execution time vs Processes
-    ax1.plot(df_sorted['PROCESSES'], df_sorted['AVG_TIME_MS'], 
+    ax1.plot(df['PROCESSES'], df['AVG_TIME_MS'], 
             marker='o', linewidth=2, markersize=10, color='blue', label='Measured')
     ax1.axhline(y=baseline_time, color='k', linestyle='--', linewidth=2, 
                 label='Baseline (1 process)', alpha=0.7)
@@ -85,10 +101,10 @@ def plot_weak_scaling(df):
     ax1.set_title('Weak Scaling: Execution Time vs Processes', fontsize=12, fontweight='bold')
     ax1.grid(True, alpha=0.3)
     ax1.legend(fontsize=10)
-    ax1.set_xticks(sorted(df['PROCESSES'].unique()))
+    ax1.set_xticks(processes)
     
     # Plot 2: Efficiency vs Processes
-    ax2.plot(df_sorted['PROCESSES'], df_sorted['EFFICIENCY'], 
+    ax2.plot(df['PROCESSES'], df['EFFICIENCY'], 
             marker='s', linewidth=2, markersize=10, color='green', label='Measured')
     ax2.axhline(y=1.0, color='k', linestyle='--', linewidth=2, label='Ideal', alpha=0.7)
     ax2.axhline(y=0.8, color='r', linestyle=':', linewidth=1.5, alpha=0.5)
@@ -98,11 +114,11 @@ def plot_weak_scaling(df):
     ax2.set_title('Weak Scaling: Parallel Efficiency', fontsize=12, fontweight='bold')
     ax2.grid(True, alpha=0.3)
     ax2.legend(fontsize=10)
-    ax2.set_xticks(sorted(df['PROCESSES'].unique()))
+    ax2.set_xticks(processes)
     ax2.set_ylim([0.5, 1.2])
     
-    plt.tight_layout()
-    plt.savefig('plots/weak_scaling.png', dpi=300, bbox_inches='tight')
+    fig.savefig('plots/weak_scaling.png', dpi=200)
+    plt.close(fig)
     print("✓ Saved: plots/weak_scaling.png")
 
 def analyze_latency_bandwidth():
@@ -111,39 +127,23 @@ def analyze_latency_bandwidth():
         print("Warning: latency_bandwidth_results.txt not found")
         return
     
-    # Parse results manually
-    latencies = []
-    bandwidths = []
-    sizes = []
+    # Parse the numeric table in C; header, separator ('=') and footer
+    # lines come back as NaN or short rows and are dropped
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        data = np.genfromtxt('latency_bandwidth_results.txt', comments='=',
+                             usecols=(0, 1, 2), invalid_raise=False, ndmin=2)
+    data = data[~np.isnan(data).any(axis=1)]
     
-    try:
-        with open('latency_bandwidth_results.txt', 'r') as f:
-            for line in f:
-                # Skip header and separator lines
-                if '=' in line or 'Message' in line or 'Benchmark' in line or \
-                   'World' in line or line.strip() == '':
-                    continue
-                
-                # Parse numeric lines
-                parts = line.split()
-                if len(parts) >= 3:
-                    try:
-                        size = int(parts[0])
-                        lat = float(parts[1])
-                        bw = float(parts[2])
-                        sizes.append(size)
-                        latencies.append(lat)
-                        bandwidths.append(bw)
-                    except ValueError:
-                        pass
-    except FileNotFoundError:
+    if data.size == 0:
         return
     
-    if not sizes:
-        return
+    sizes = data[:, 0].astype(int)
+    latencies = data[:, 1]
+    bandwidths = data[:, 2]
     
     # Create plot
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5))
+    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 5), constrained_layout=True)
     
     # Latency plot
     ax1.loglog(sizes, latencies, 'o-', linewidth=2, markersize=8, color='red')
@@ -159,8 +159,8 @@ def analyze_latency_bandwidth():
     ax2.set_title('Point-to-Point Bandwidth', fontsize=12, fontweight='bold')
     ax2.grid(True, alpha=0.3, which='both')
     
-    plt.tight_layout()
-    plt.savefig('plots/latency_bandwidth.png', dpi=300, bbox_inches='tight')
+    fig.savefig('plots/latency_bandwidth.png', dpi=200)
+    plt.close(fig)
     print("✓ Saved: plots/latency_bandwidth.png")
 
 def print_analysis_summary():
@@ -171,14 +171,14 @@ def print_analysis_summary():
     
     # Strong scaling analysis
     if os.path.exists('strong_scaling_results.csv'):
-        df = pd.read_csv('strong_scaling_results.csv')
+        df = load_scaling_results('strong_scaling_results.csv')
         print("\nStrong Scaling Results:")
         print("-" * 80)
         print(df.to_string(index=False))
     
     # Weak scaling analysis
     if os.path.exists('weak_scaling_results.csv'):
-        df = pd.read_csv('weak_scaling_results.csv')
+        df = load_scaling_results('weak_scaling_results.csv')
         print("\nWeak Scaling Results:")
         print("-" * 80)
         print(df.to_string(index=False))
@@ -194,12 +194,15 @@ def main():
     # Load and analyze results
     print("Generating visualizations...")
     
+    # Sort once; the plot functions rely on this order
     strong_df = load_scaling_results('strong_scaling_results.csv')
     if strong_df is not None:
+        strong_df = strong_df.sort_values(['IMAGE_SIZE', 'PROCESSES']).reset_index(drop=True)
         plot_strong_scaling(strong_df)
     
     weak_df = load_scaling_results('weak_scaling_results.csv')
     if weak_df is not None:
+        weak_df = weak_df.sort_values('PROCESSES', kind='stable').reset_index(drop=True)
         plot_weak_scaling(weak_df)
     
     analyze_latency_bandwidth()
@@ -4,6 +4,9 @@ Generates synthetic images and sends continuous requests for testing.
 """
 
 import argparse
+import asyncio
+import logging
+import signal
 import time
 import numpy as np
 import sys
@@ -14,177 +17,277 @@ from datetime import datetime
 # Add proto directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
-from client.sobel_client import ResilientSobelClient
+from client.sobel_client import AsyncResilientSobelClient
+
+try:
+    import orjson
+    
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
 
 
 class LoadGenerator:
     """Generate continuous load on Sobel service."""
     
-    def __init__(self, client: ResilientSobelClient, 
+    # Distinct payloads generated per image size
+    PAYLOAD_POOL_SIZE = 8
+    
+    def __init__(self, client: AsyncResilientSobelClient, 
                  image_sizes: list = [(256, 256), (512, 512)],
-                 requests_per_second: float = 10.0):
+                 requests_per_second: float = 10.0,
+                 concurrency: int = 4):
         """
         Initialize load generator.
         
         Args:
-            client: ResilientSobelClient instance
+            client: AsyncResilientSobelClient instance
             image_sizes: List of (width, height) tuples for test images
             requests_per_second: Target request rate
+            concurrency: Maximum number of requests in flight at once
         """
         self.client = client
         self.image_sizes = image_sizes
         self.requests_per_second = requests_per_second
         self.request_interval = 1.0 / requests_per_second
+        self.concurrency = concurrency
         
-        # Metrics
-        self.request_log = []
+        # Metrics: per-request latency (ms) and success flag, indexed by
+        # request number, for the end-of-run summary
+        self._latencies = np.empty(0, dtype=np.float32)
+        self._succeeded = np.zeros(0, dtype=bool)
         self.request_count = 0
+        self.skipped_slots = 0
+        
+        # Pre-generated payloads per size, cycled through by run(); the noise
+        # for a whole pool comes from a single RNG call
+        self._payload_pool = {}
+        for w, h in image_sizes:
+            noise = np.random.randint(0, 256, (self.PAYLOAD_POOL_SIZE, h, w), dtype=np.uint8)
+            self._payload_pool[(w, h)] = [self.generate_test_image(w, h, noise[k])
+                                          for k in range(self.PAYLOAD_POOL_SIZE)]
     
-    def generate_test_image(self, width: int, height: int) -> bytes:
+    def generate_test_image(self, width: int, height: int,
+                            noise: np.ndarray = None) -> bytes:
         """
         Generate a synthetic test image.
         
-        Uses random patterns to ensure some computation load.
+        Uses random patterns to ensure some computation load. A (height, width)
+        uint8 noise array may be passed in; otherwise one is drawn.
         """
         # Generate image with random patterns
-        image = np.random.randint(0, 256, (height, width), dtype=np.uint8)
+        if noise is None:
+            noise = np.random.randint(0, 256, (height, width), dtype=np.uint8)
         
         # Add some structure (gradients, edges)
         x = np.linspace(0, 255, width, dtype=np.uint8)
         y = np.linspace(0, 255, height, dtype=np.uint8)
+        
         xx, yy = np.meshgrid(x, y)
         
         # Blend with gradient
-        image = (image * 0.5 + (xx + yy) * 0.25).astype(np.uint8)
+        image = (noise * 0.5 + (xx + yy) * 0.25).astype(np.uint8)
         
         return image.tobytes()
     
-    def run(self, duration_seconds: int = 60, log_file: str = None):
+    def _grow_records(self, min_size: int):
+        """Grow the per-request arrays to at least min_size (amortized doubling)."""
+        size = max(min_size, 2 * len(self._latencies))
+        self._latencies = np.resize(self._latencies, size)
+        succeeded = np.zeros(size, dtype=bool)
+        succeeded[:len(self._succeeded)] = self._succeeded
+        self._succeeded = succeeded
+    
+    async def run(self, duration_seconds: int = 60, log_file: str = None):
         """
         Run load generation for specified duration.
         
         Args:
             duration_seconds: How long to run (seconds)
-            log_file: Path to save request log (JSON)
+            log_file: Path to save request log (NDJSON: a metadata line,
+                one line per request, then a final metadata/client_stats line)
         """
         print(f"Starting load generation...")
         print(f"  Duration: {duration_seconds} seconds")
         print(f"  Target rate: {self.requests_per_second} req/sec")
+        print(f"  Concurrency: {self.concurrency}")
         print(f"  Image sizes: {self.image_sizes}")
         print(f"  Servers: {self.client.server_addresses}")
         print()
         
+        # Monotonic integer clock on the hot path; wall-clock start_time is
+        # only used to anchor the logged timestamps
+        now = time.monotonic_ns
         start_time = time.time()
-        end_time = start_time + duration_seconds
+        start_ns = now()
+        end_ns = start_ns + int(duration_seconds * 1_000_000_000)
+        interval_ns = self.request_interval * 1e9
+        progress_every = int(self.requests_per_second * 10)
+        size_labels = {(w, h): f"{w}x{h}" for w, h in self.image_sizes}
         
-        request_id = 0
+        log_fp = open(log_file, 'wb') if log_file else None
+        if log_fp:
+            log_fp.write(_dumps({'metadata': {
+                'start_time': start_time,
+                'target_rate': self.requests_per_second,
+                'servers': self.client.server_addresses
+            }}) + b'\n')
         
         try:
-            while time.time() < end_time:
-                loop_start = time.time()
-                
-                # Select random image size
-                width, height = self.image_sizes[request_id % len(self.image_sizes)]
+            # Preallocate for the expected number of requests
+            self._grow_records(self.request_count + int(duration_seconds * self.requests_per_second) + 1)
+        
+            in_flight = asyncio.Semaphore(self.concurrency)
+            pending = set()
+        
+            async def send(request_id: int, width: int, height: int, image_data: bytes):
+                try:
+                    req_id = f"req-{request_id:06d}"
+                    request_ns = now()
                 
-                # Generate image
-                image_data = self.generate_test_image(width, height)
+                    response = await self.client.process_image(image_data, width, height, req_id)
                 
-                # Send request
-                req_id = f"req-{request_id:06d}"
-                request_timestamp = time.time()
+                    response_ns = now()
+                    latency_ms = (response_ns - request_ns) / 1e6
                 
-                response = self.client.process_image(image_data, width, height, req_id)
+                    # Log result
+                    log_entry = {
+                        'request_id': req_id,
+                        'timestamp': start_time + (request_ns - start_ns) / 1e9,
+                        'latency_ms': latency_ms,
+                        'success': response is not None,
+                        'server_id': response.server_id if response else None,
+                        'image_size': size_labels[(width, height)],
+                        'processing_time_ms': response.processing_time_ms if response else None
+                    }
+                    if log_fp:
+                        log_fp.write(_dumps(log_entry))
+                        log_fp.write(b'\n')
+                    if request_id >= len(self._latencies):
+                        self._grow_records(request_id + 1)
+                    self._latencies[request_id] = latency_ms
+                    self._succeeded[request_id] = response is not None
+                finally:
+                    in_flight.release()
+        
+            request_id = 0
+            # Schedule slot the next request is due in; slots missed while the
+            # loop was stalled (e.g. all concurrency slots blocked on a frozen
+            # server) are dropped and counted, not replayed as a burst
+            slot = 0
+            self.skipped_slots = 0
+        
+            try:
+                while now() < end_ns:
+                    # Select random image size
+                    width, height = self.image_sizes[request_id % len(self.image_sizes)]
                 
-                response_timestamp = time.time()
-                latency_ms = (response_timestamp - request_timestamp) * 1000
+                    # Pick a pre-generated image
+                    pool = self._payload_pool[(width, height)]
+                    image_data = pool[(request_id // len(self.image_sizes)) % len(pool)]
                 
-                # Log result
-                log_entry = {
-                    'request_id': req_id,
-                    'timestamp': request_timestamp,
-                    'latency_ms': latency_ms,
-                    'success': response is not None,
-                    'server_id': response.server_id if response else None,
-                    'image_size': f"{width}x{height}",
-                    'processing_time_ms': response.processing_time_ms if response else None
-                }
-                self.request_log.append(log_entry)
+                    # Send request once a concurrency slot is free
+                    await in_flight.acquire()
+                    task = asyncio.create_task(send(request_id, width, height, image_data))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
                 
-                request_id += 1
-                self.request_count += 1
+                    request_id += 1
+                    self.request_count += 1
+                    slot += 1
                 
-                # Rate limiting
-                elapsed = time.time() - loop_start
-                sleep_time = max(0, self.request_interval - elapsed)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
+                    # Rate limiting: pace against absolute deadlines so jitter
+                    # does not accumulate, and skip sub-millisecond sleeps
+                    deadline_ns = start_ns + int(slot * interval_ns)
+                    lag_ns = now() - deadline_ns
+                    if lag_ns > interval_ns:
+                        missed = int(lag_ns // interval_ns)
+                        slot += missed
+                        self.skipped_slots += missed
+                        deadline_ns = start_ns + int(slot * interval_ns)
+                    slack = (deadline_ns - now()) / 1e9
+                    if slack > 0.0005:
+                        await asyncio.sleep(slack)
                 
-                # Progress update every 10 seconds
-                if request_id % (int(self.requests_per_second * 10)) == 0:
-                    elapsed_total = time.time() - start_time
-                    actual_rate = request_id / elapsed_total
-                    success_rate = self.client.successful_requests / request_id if request_id > 0 else 0
-                    print(f"[{elapsed_total:.1f}s] Sent {request_id} requests "
-                          f"(rate: {actual_rate:.1f} req/s, success: {success_rate*100:.1f}%)")
-        
-        except KeyboardInterrupt:
-            print("\nLoad generation interrupted by user")
-        
-        # Final statistics
-        total_time = time.time() - start_time
-        actual_rate = self.request_count / total_time
-        
-        print(f"\n{'='*60}")
-        print("Load Generation Complete")
-        print(f"{'='*60}")
-        print(f"Duration: {total_time:.2f} seconds")
-        print(f"Total requests: {self.request_count}")
-        print(f"Actual rate: {actual_rate:.2f} req/sec")
-        print()
-        
-        client_stats = self.client.get_statistics()
-        print("Client Statistics:")
-        print(f"  Successful: {client_stats['successful_requests']}")
-        print(f"  Failed: {client_stats['failed_requests']}")
-        print(f"  Success rate: {client_stats['success_rate']*100:.2f}%")
-        print(f"  Retries: {client_stats['retries_count']}")
-        print(f"  Failovers: {client_stats['failover_count']}")
-        
-        # Calculate latency percentiles
-        successful_latencies = [entry['latency_ms'] for entry in self.request_log 
-                                if entry['success']]
-        
-        if successful_latencies:
-            successful_latencies.sort()
-            p50 = successful_latencies[int(len(successful_latencies) * 0.50)]
-            p95 = successful_latencies[int(len(successful_latencies) * 0.95)]
-            p99 = successful_latencies[int(len(successful_latencies) * 0.99)]
+                    # Progress update every 10 seconds
+                    if request_id % progress_every == 0:
+                        elapsed_total = (now() - start_ns) / 1e9
+                        actual_rate = request_id / elapsed_total
+                        success_rate = self.client.successful_requests / request_id if request_id > 0 else 0
+                        print(f"[{elapsed_total:.1f}s] Sent {request_id} requests "
+                              f"(rate: {actual_rate:.1f} req/s, success: {success_rate*100:.1f}%)")
+                        if log_fp:
+                            # Keep the on-disk log current if the process is killed
+                            log_fp.flush()
             
+                # Wait for requests still in flight
+                if pending:
+                    await asyncio.gather(*pending)
+        
+            except (KeyboardInterrupt, asyncio.CancelledError):
+                print("\nLoad generation interrupted by user")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        
+            # Final statistics
+            total_time = (now() - start_ns) / 1e9
+            actual_rate = self.request_count / total_time
+        
+            print(f"\n{'='*60}")
+            print("Load Generation Complete")
+            print(f"{'='*60}")
+            print(f"Duration: {total_time:.2f} seconds")
+            print(f"Total requests: {self.request_count}")
+            print(f"Actual rate: {actual_rate:.2f} req/sec")
+            print(f"Skipped slots: {self.skipped_slots} (sender stalled behind the target rate)")
             print()
-            print("Latency Statistics:")
-            print(f"  Min: {min(successful_latencies):.2f} ms")
-            print(f"  p50: {p50:.2f} ms")
-            print(f"  p95: {p95:.2f} ms")
-            print(f"  p99: {p99:.2f} ms")
-            print(f"  Max: {max(successful_latencies):.2f} ms")
-        
-        # Save log to file
-        if log_file:
-            with open(log_file, 'w') as f:
-                json.dump({
+        
+            client_stats = self.client.get_statistics()
+            print("Client Statistics:")
+            print(f"  Successful: {client_stats['successful_requests']}")
+            print(f"  Failed: {client_stats['failed_requests']}")
+            print(f"  Success rate: {client_stats['success_rate']*100:.2f}%")
+            print(f"  Retries: {client_stats['retries_count']}")
+            print(f"  Failovers: {client_stats['failover_count']}")
+        
+            # Calculate latency percentiles
+            n = self.request_count
+            latencies = self._latencies[:n][self._succeeded[:n]]
+        
+            if latencies.size:
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99], method='nearest')
+            
+                print()
+                print("Latency Statistics:")
+                print(f"  Min: {latencies.min():.2f} ms")
+                print(f"  p50: {p50:.2f} ms")
+                print(f"  p95: {p95:.2f} ms")
+                print(f"  p99: {p99:.2f} ms")
+                print(f"  Max: {latencies.max():.2f} ms")
+        
+            # Finish log file
+            if log_fp:
+                log_fp.write(_dumps({
                     'metadata': {
                         'start_time': start_time,
                         'duration_seconds': total_time,
                         'target_rate': self.requests_per_second,
                         'actual_rate': actual_rate,
                         'total_requests': self.request_count,
+                        'skipped_slots': self.skipped_slots,
                         'servers': self.client.server_addresses
                     },
-                    'client_stats': client_stats,
-                    'requests': self.request_log
-                }, f, indent=2)
+                    'client_stats': client_stats
+                }) + b'\n')
             
-            print(f"\nLog saved to: {log_file}")
+                print(f"\nLog saved to: {log_file}")
+        finally:
+            # Always close so buffered request lines reach disk
+            if log_fp:
+                log_fp.close()
 
 
 def main():
@@ -195,6 +298,8 @@ def main():
                        help='Duration in seconds (default: 60)')
     parser.add_argument('--rate', type=float, default=10.0,
                        help='Target requests per second (default: 10.0)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                       help='Maximum requests in flight (default: 4)')
     parser.add_argument('--sizes', type=str, default='256x256,512x512',
                        help='Comma-separated image sizes (e.g., 256x256,512x512)')
     parser.add_argument('--log', type=str, default='load_test.json',
@@ -202,6 +307,11 @@ def main():
     
     args = parser.parse_args()
     
+    # Client retries/failovers are logged at WARNING; LOG_LEVEL=INFO adds
+    # connection and health changes
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper(),
+                        format='%(asctime)s %(levelname)s %(message)s')
+    
     # Parse servers
     server_addresses = [s.strip() for s in args.servers.split(',')]
     
@@ -211,26 +321,39 @@ def main():
         width, height = map(int, size_str.split('x'))
         image_sizes.append((width, height))
     
+    asyncio.run(_run_load_test(args, server_addresses, image_sizes))
+
+
+async def _run_load_test(args, server_addresses: list, image_sizes: list):
+    """Create the client inside the event loop and run the load test."""
     # Create client
-    client = ResilientSobelClient(
+    client = AsyncResilientSobelClient(
         server_addresses,
         max_retries=3,
         initial_backoff_ms=100,
-        max_backoff_ms=5000
+        max_backoff_ms=5000,
+        # Payloads come from a fixed pool, so their serialization is reused
+        request_cache_size=LoadGenerator.PAYLOAD_POOL_SIZE * len(image_sizes)
     )
     
     # Create load generator
     generator = LoadGenerator(
         client,
         image_sizes=image_sizes,
-        requests_per_second=args.rate
+        requests_per_second=args.rate,
+        concurrency=args.concurrency
     )
     
+    # SIGTERM ends the run like Ctrl+C: cancel, then write stats and the
+    # log trailer
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel)
+    
     # Run load test
-    generator.run(duration_seconds=args.duration, log_file=args.log)
+    await generator.run(duration_seconds=args.duration, log_file=args.log)
     
     # Cleanup
-    client.close()
+    await client.close()
 
 
 if __name__ == '__main__':
@@ -2,11 +2,17 @@
 Resilient gRPC client with automatic retry and failover.
 """
 
+import asyncio
 import grpc
-import time
+import grpc.aio
+import json
+import logging
 import random
+import threading
+import time
 import sys
 import os
+from collections import OrderedDict, deque
 from typing import List, Optional
 
 # Add proto directory to path
@@ -15,6 +21,116 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 import sobel_service_pb2
 import sobel_service_pb2_grpc
 
+# Keep idle connections warm with HTTP/2 pings and allow messages large
+# enough for 2048x2048+ images (the gRPC default limit is 4 MB)
+MAX_MESSAGE_BYTES = 64 << 20
+CHANNEL_OPTIONS = [
+    ('grpc.keepalive_time_ms', 10000),
+    ('grpc.keepalive_timeout_ms', 5000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    ('grpc.max_send_message_length', MAX_MESSAGE_BYTES),
+    ('grpc.max_receive_message_length', MAX_MESSAGE_BYTES),
+    ('grpc.use_local_subchannel_pool', 1),
+    # Let gRPC itself retry calls that never reached a server (UNAVAILABLE)
+    # before the client's own retry/failover loop sees the error
+    ('grpc.enable_retries', 1),
+    ('grpc.service_config', json.dumps({
+        'methodConfig': [{
+            'name': [{'service': 'sobel.SobelService'}],
+            'retryPolicy': {
+                'maxAttempts': 3,
+                'initialBackoff': '0.05s',
+                'maxBackoff': '1s',
+                'backoffMultiplier': 2,
+                'retryableStatusCodes': ['UNAVAILABLE'],
+            },
+        }]
+    })),
+]
+
+# ProcessImage is called with pre-serialized request bytes (see
+# ResilientSobelClient._build_request)
+PROCESS_IMAGE_METHOD = '/sobel.SobelService/ProcessImage'
+
+logger = logging.getLogger(__name__)
+
+# Circuit breaker defaults: trip after this many consecutive failures, or
+# when the p95 of the last CIRCUIT_LATENCY_WINDOW successes exceeds the
+# latency threshold; stay open for the cooldown before a half-open probe
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN_S = 10.0
+CIRCUIT_LATENCY_THRESHOLD_MS = 5000.0
+CIRCUIT_LATENCY_WINDOW = 50
+
+
+class CircuitBreaker:
+    """
+    Per-server circuit breaker (CLOSED -> OPEN -> HALF_OPEN -> CLOSED).
+    
+    While OPEN the server is skipped without a call. Once the cooldown has
+    passed a single probe request is let through (HALF_OPEN); its success
+    closes the breaker and its failure re-opens it for another cooldown.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 cooldown_s: float = CIRCUIT_COOLDOWN_S,
+                 latency_threshold_ms: float = CIRCUIT_LATENCY_THRESHOLD_MS,
+                 latency_window: int = CIRCUIT_LATENCY_WINDOW):
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self.latency_threshold_ms = latency_threshold_ms
+        self.state = self.CLOSED
+        self.failure_count = 0
+        self.opened_at = 0.0
+        self.half_open_probes = 0
+        self.trips = 0
+        self.latencies = deque(maxlen=latency_window)
+    
+    def allow_request(self, now: float) -> bool:
+        """Return True if a request may be sent to this server now."""
+        if self.state == self.CLOSED:
+            return True
+        if now - self.opened_at < self.cooldown_s:
+            return False
+        # Let one probe through and restart the clock, so a probe that never
+        # reports back cannot wedge the breaker
+        self.state = self.HALF_OPEN
+        self.opened_at = now
+        self.half_open_probes += 1
+        return True
+    
+    def record_success(self, latency_ms: float):
+        """Record a successful call and its latency."""
+        self.failure_count = 0
+        if self.state == self.HALF_OPEN:
+            self.state = self.CLOSED
+        
+        self.latencies.append(latency_ms)
+        # The rolling p95 can only cross the threshold on a slow sample
+        if (latency_ms > self.latency_threshold_ms
+                and len(self.latencies) == self.latencies.maxlen):
+            window = sorted(self.latencies)
+            if window[int(len(window) * 0.95)] > self.latency_threshold_ms:
+                self._trip()
+    
+    def record_failure(self):
+        """Record a failed call, tripping the breaker at the threshold."""
+        self.failure_count += 1
+        if self.state == self.HALF_OPEN or self.failure_count >= self.failure_threshold:
+            self._trip()
+    
+    def _trip(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.failure_count = 0
+        self.latencies.clear()
+        self.trips += 1
+
 
 class ResilientSobelClient:
     """
@@ -23,7 +139,8 @@ class ResilientSobelClient:
     
     def __init__(self, server_addresses: List[str], max_retries: int = 3,
                  initial_backoff_ms: int = 100, max_backoff_ms: int = 5000,
-                 client_id: str = "client-1"):
+                 client_id: str = "client-1", jitter_seed: Optional[int] = None,
+                 request_cache_size: int = 0):
         """
         Initialize resilient client.
         
@@ -31,23 +148,41 @@ class ResilientSobelClient:
             server_addresses: List of "host:port" strings
             max_retries: Maximum retry attempts per request
             initial_backoff_ms: Initial backoff delay in ms
-            max_backoff_ms: Maximum backoff delay in ms
+            max_backoff_ms: Maximum backoff delay in ms. The backoff cap
+                doubles up to this value, but each sleep is drawn uniformly
+                from [0, cap] ("full jitter") so clients sharing an outage
+                do not retry in lockstep.
             client_id: Client identifier
+            jitter_seed: Seed for the backoff jitter, for reproducible runs
+                (default: seeded from the OS)
+            request_cache_size: Number of serialized image payloads to keep
+                for callers that resend the same payloads (default: 0, off)
         """
         self.server_addresses = server_addresses
         self.max_retries = max_retries
         self.initial_backoff_ms = initial_backoff_ms
         self.max_backoff_ms = max_backoff_ms
         self.client_id = client_id
+        self._rng = random.Random(jitter_seed)
         
         # Connection pool
         self.channels = {}
         self.stubs = {}
+        self.process_calls = {}
+        self.request_cache_size = request_cache_size
+        self._request_cache = OrderedDict()
+        self._request_cache_lock = threading.Lock()
         self._initialize_connections()
         
         # Server health tracking
         self.server_health = {addr: True for addr in server_addresses}
         self.last_health_check = {addr: 0 for addr in server_addresses}
+        self.breakers = {addr: CircuitBreaker() for addr in server_addresses}
+        # Round-robin ring of healthy servers, rotated on every pick, and
+        # unhealthy servers -> monotonic time they are re-admitted at
+        self._healthy = deque(server_addresses)
+        self._sick = {}
+        self._health_lock = threading.RLock()
         
         # Statistics
         self.total_requests = 0
@@ -60,31 +195,56 @@ class ResilientSobelClient:
         """Create connections to all servers."""
         for addr in self.server_addresses:
             try:
-                channel = grpc.insecure_channel(addr)
+                channel = grpc.insecure_channel(addr, options=CHANNEL_OPTIONS)
                 self.channels[addr] = channel
                 self.stubs[addr] = sobel_service_pb2_grpc.SobelServiceStub(channel)
-                print(f"[{self.client_id}] Connected to {addr}")
+                self.process_calls[addr] = channel.unary_unary(
+                    PROCESS_IMAGE_METHOD,
+                    response_deserializer=sobel_service_pb2.ImageResponse.FromString)
+                logger.info("[%s] Connected to %s", self.client_id, addr)
             except Exception as e:
-                print(f"[{self.client_id}] Warning: Could not connect to {addr}: {e}")
+                logger.warning("[%s] Could not connect to %s: %s", self.client_id, addr, e)
     
     def _select_server(self) -> Optional[str]:
         """
         Select a healthy server (round-robin with health awareness).
+        Servers whose circuit breaker is open are skipped, and unhealthy
+        servers rejoin the rotation once their cooldown has passed.
         Returns None if no healthy servers available.
         """
-        healthy_servers = [addr for addr in self.server_addresses 
-                          if self.server_health[addr]]
-        
-        if not healthy_servers:
-            return None
-        
-        # Simple round-robin among healthy servers
-        return random.choice(healthy_servers)
+        now = time.monotonic()
+        with self._health_lock:
+            if self._sick:
+                for addr, until in list(self._sick.items()):
+                    if until <= now:
+                        logger.info("[%s] Re-admitting %s after cooldown", self.client_id, addr)
+                        self._mark_server_healthy(addr)
+            
+            for _ in range(len(self._healthy)):
+                addr = self._healthy[0]
+                self._healthy.rotate(-1)
+                if self.breakers[addr].allow_request(now):
+                    return addr
+        return None
     
     def _mark_server_unhealthy(self, addr: str):
-        """Mark a server as unhealthy."""
-        self.server_health[addr] = False
-        print(f"[{self.client_id}] Marked {addr} as UNHEALTHY")
+        """Mark a server as unhealthy for one circuit breaker cooldown."""
+        with self._health_lock:
+            if self.server_health[addr]:
+                self.server_health[addr] = False
+                self._healthy.remove(addr)
+            self._sick[addr] = time.monotonic() + self.breakers[addr].cooldown_s
+        logger.warning("[%s] Marked %s as UNHEALTHY", self.client_id, addr)
+    
+    def _mark_server_healthy(self, addr: str) -> bool:
+        """Return a server to the rotation; True if it was unhealthy."""
+        with self._health_lock:
+            self._sick.pop(addr, None)
+            if self.server_health[addr]:
+                return False
+            self.server_health[addr] = True
+            self._healthy.append(addr)
+            return True
     
     def _check_server_health(self, addr: str) -> bool:
         """
@@ -103,20 +263,113 @@ class ResilientSobelClient:
             stub = self.stubs[addr]
             request = sobel_service_pb2.HealthRequest(client_id=self.client_id)
             response = stub.HealthCheck(request, timeout=2)
-            
-            if response.healthy:
-                if not self.server_health[addr]:
-                    print(f"[{self.client_id}] {addr} is now HEALTHY")
-                self.server_health[addr] = True
-                return True
-            else:
-                self._mark_server_unhealthy(addr)
-                return False
+            return self._apply_health_response(addr, response)
                 
         except Exception as e:
             self._mark_server_unhealthy(addr)
             return False
     
+    def _reprobe_servers(self) -> bool:
+        """
+        Actively probe the servers currently marked unhealthy.
+        
+        Health is otherwise tracked passively from ProcessImage errors, so
+        this is only called once every server has been marked down.
+        Returns True if any server recovered.
+        """
+        recovered = False
+        for addr in self.server_addresses:
+            if not self.server_health[addr] and self._check_server_health(addr):
+                recovered = True
+        return recovered
+    
+    def _apply_health_response(self, addr: str, response) -> bool:
+        """Update health state from a HealthCheck response."""
+        if response.healthy:
+            if self._mark_server_healthy(addr):
+                logger.info("[%s] %s is now HEALTHY", self.client_id, addr)
+            return True
+        else:
+            self._mark_server_unhealthy(addr)
+            return False
+    
+    def _backoff_delay(self, backoff_ms: float) -> float:
+        """Return a full-jitter sleep in seconds for the current backoff cap."""
+        return self._rng.uniform(0, backoff_ms) / 1000.0
+    
+    def _build_request(self, image_data: bytes, width: int, height: int,
+                       request_id: str) -> bytes:
+        """
+        Build the serialized ProcessImage request.
+        
+        With request_cache_size set, the image fields are serialized once
+        per distinct payload and cached; each call then only serializes
+        request_id/timestamp_ms and appends them (concatenated protobuf
+        encodings parse as one merged message).
+        """
+        if not self.request_cache_size:
+            return sobel_service_pb2.ImageRequest(
+                width=width,
+                height=height,
+                image_data=image_data,
+                request_id=request_id,
+                timestamp_ms=int(time.time() * 1000)
+            ).SerializeToString()
+        
+        return self._image_prefix(image_data, width, height) + sobel_service_pb2.ImageRequest(
+            request_id=request_id,
+            timestamp_ms=int(time.time() * 1000)
+        ).SerializeToString()
+    
+    def _image_prefix(self, image_data: bytes, width: int, height: int) -> bytes:
+        """Return the cached serialized image fields for a payload."""
+        # bytes caches its own hash, so a resent payload is only hashed once;
+        # only the prefix is kept, never a reference to the payload
+        key = (width, height, len(image_data), hash(image_data))
+        with self._request_cache_lock:
+            prefix = self._request_cache.get(key)
+            if prefix is not None:
+                self._request_cache.move_to_end(key)
+                return prefix
+        
+        prefix = sobel_service_pb2.ImageRequest(
+            width=width,
+            height=height,
+            image_data=image_data
+        ).SerializeToString()
+        with self._request_cache_lock:
+            self._request_cache[key] = prefix
+            while len(self._request_cache) > self.request_cache_size:
+                self._request_cache.popitem(last=False)
+        return prefix
+    
+    def _record_success(self, server_addr: str, attempt: int, latency_ms: float):
+        """Update statistics after a successful attempt."""
+        self.breakers[server_addr].record_success(latency_ms)
+        self.successful_requests += 1
+        if attempt > 0:
+            self.retries_count += attempt
+    
+    def _record_rpc_error(self, server_addr: str, request_id: str,
+                          status_code: grpc.StatusCode, attempt: int):
+        """Log a failed attempt and mark the server unhealthy on certain errors."""
+        self.breakers[server_addr].record_failure()
+        logger.warning("[%s] Request %s failed on %s: %s (attempt %d/%d)",
+                       self.client_id, request_id, server_addr, status_code,
+                       attempt + 1, self.max_retries)
+        
+        if status_code in [grpc.StatusCode.UNAVAILABLE, 
+                          grpc.StatusCode.DEADLINE_EXCEEDED,
+                          grpc.StatusCode.INTERNAL]:
+            self._mark_server_unhealthy(server_addr)
+            self.failover_count += 1
+    
+    def _record_failure(self, request_id: str):
+        """Update statistics once all retries are exhausted."""
+        self.failed_requests += 1
+        logger.error("[%s] Request %s FAILED after %d attempts",
+                     self.client_id, request_id, self.max_retries)
+    
     def process_image(self, image_data: bytes, width: int, height: int,
                      request_id: str) -> Optional[sobel_service_pb2.ImageResponse]:
         """
@@ -127,73 +380,51 @@ class ResilientSobelClient:
         """
         self.total_requests += 1
         
-        request = sobel_service_pb2.ImageRequest(
-            width=width,
-            height=height,
-            image_data=image_data,
-            request_id=request_id,
-            timestamp_ms=int(time.time() * 1000)
-        )
+        request = self._build_request(image_data, width, height, request_id)
         
         backoff_ms = self.initial_backoff_ms
-        last_exception = None
         
         for attempt in range(self.max_retries):
             # Select a server
             server_addr = self._select_server()
             
             if server_addr is None:
-                print(f"[{self.client_id}] No healthy servers available!")
-                time.sleep(backoff_ms / 1000.0)
+                logger.warning("[%s] No healthy servers available!", self.client_id)
+                time.sleep(self._backoff_delay(backoff_ms))
                 backoff_ms = min(backoff_ms * 2, self.max_backoff_ms)
                 
-                # Try to recover by checking all servers
-                for addr in self.server_addresses:
-                    self._check_server_health(addr)
+                # Try to recover by probing the downed servers
+                self._reprobe_servers()
                 
                 continue
             
             try:
-                stub = self.stubs[server_addr]
-                response = stub.ProcessImage(request, timeout=10)
-                
-                self.successful_requests += 1
-                if attempt > 0:
-                    self.retries_count += attempt
+                call_start = time.monotonic()
+                response = self.process_calls[server_addr](request, timeout=10)
                 
+                self._record_success(server_addr, attempt,
+                                     (time.monotonic() - call_start) * 1000)
                 return response
                 
             except grpc.RpcError as e:
-                last_exception = e
-                status_code = e.code()
-                
-                print(f"[{self.client_id}] Request {request_id} failed on {server_addr}: "
-                      f"{status_code} (attempt {attempt + 1}/{self.max_retries})")
+                self._record_rpc_error(server_addr, request_id, e.code(), attempt)
                 
-                # Mark server unhealthy on certain errors
-                if status_code in [grpc.StatusCode.UNAVAILABLE, 
-                                  grpc.StatusCode.DEADLINE_EXCEEDED,
-                                  grpc.StatusCode.INTERNAL]:
-                    self._mark_server_unhealthy(server_addr)
-                    self.failover_count += 1
-                
-                # Exponential backoff
+                # Exponential backoff with full jitter
                 if attempt < self.max_retries - 1:
-                    time.sleep(backoff_ms / 1000.0)
+                    time.sleep(self._backoff_delay(backoff_ms))
                     backoff_ms = min(backoff_ms * 2, self.max_backoff_ms)
             
             except Exception as e:
-                last_exception = e
-                print(f"[{self.client_id}] Unexpected error on {server_addr}: {e}")
+                logger.error("[%s] Unexpected error on %s: %s", self.client_id, server_addr, e)
+                self.breakers[server_addr].record_failure()
                 self._mark_server_unhealthy(server_addr)
                 
                 if attempt < self.max_retries - 1:
-                    time.sleep(backoff_ms / 1000.0)
+                    time.sleep(self._backoff_delay(backoff_ms))
                     backoff_ms = min(backoff_ms * 2, self.max_backoff_ms)
         
         # All retries exhausted
-        self.failed_requests += 1
-        print(f"[{self.client_id}] Request {request_id} FAILED after {self.max_retries} attempts")
+        self._record_failure(request_id)
         return None
     
     def get_statistics(self) -> dict:
@@ -204,7 +435,11 @@ class ResilientSobelClient:
             'failed_requests': self.failed_requests,
             'retries_count': self.retries_count,
             'failover_count': self.failover_count,
-            'success_rate': self.successful_requests / self.total_requests if self.total_requests > 0 else 0
+            'success_rate': self.successful_requests / self.total_requests if self.total_requests > 0 else 0,
+            'circuit_breakers': {
+                addr: {'state': breaker.state, 'trips': breaker.trips}
+                for addr, breaker in self.breakers.items()
+            }
         }
     
     def close(self):
@@ -212,15 +447,150 @@ class ResilientSobelClient:
         for addr, channel in self.channels.items():
             try:
                 channel.close()
-                print(f"[{self.client_id}] Closed connection to {addr}")
+                logger.info("[%s] Closed connection to %s", self.client_id, addr)
+            except:
+                pass
+
+
+class AsyncResilientSobelClient(ResilientSobelClient):
+    """
+    asyncio variant of ResilientSobelClient built on grpc.aio.
+    
+    process_image is a coroutine, so many requests can be in flight on the
+    same channels at once. Create it from inside a running event loop.
+    """
+    
+    def _initialize_connections(self):
+        """Create grpc.aio connections to all servers."""
+        for addr in self.server_addresses:
+            try:
+                channel = grpc.aio.insecure_channel(addr, options=CHANNEL_OPTIONS)
+                self.channels[addr] = channel
+                self.stubs[addr] = sobel_service_pb2_grpc.SobelServiceStub(channel)
+                self.process_calls[addr] = channel.unary_unary(
+                    PROCESS_IMAGE_METHOD,
+                    response_deserializer=sobel_service_pb2.ImageResponse.FromString)
+                logger.info("[%s] Connected to %s", self.client_id, addr)
+            except Exception as e:
+                logger.warning("[%s] Could not connect to %s: %s", self.client_id, addr, e)
+    
+    async def _check_server_health(self, addr: str) -> bool:
+        """Async version of ResilientSobelClient._check_server_health."""
+        current_time = time.time()
+        
+        if current_time - self.last_health_check[addr] < 5:
+            return self.server_health[addr]
+        
+        self.last_health_check[addr] = current_time
+        
+        try:
+            stub = self.stubs[addr]
+            request = sobel_service_pb2.HealthRequest(client_id=self.client_id)
+            response = await stub.HealthCheck(request, timeout=2)
+            return self._apply_health_response(addr, response)
+        
+        except Exception as e:
+            self._mark_server_unhealthy(addr)
+            return False
+    
+    async def _reprobe_servers(self) -> bool:
+        """Async version of ResilientSobelClient._reprobe_servers."""
+        recovered = False
+        for addr in self.server_addresses:
+            if not self.server_health[addr] and await self._check_server_health(addr):
+                recovered = True
+        return recovered
+    
+    async def process_image(self, image_data: bytes, width: int, height: int,
+                            request_id: str) -> Optional[sobel_service_pb2.ImageResponse]:
+        """
+        Process an image with automatic retry and failover.
+        
+        Returns:
+            ImageResponse on success, None on failure after all retries
+        """
+        self.total_requests += 1
+        
+        request = self._build_request(image_data, width, height, request_id)
+        
+        backoff_ms = self.initial_backoff_ms
+        
+        for attempt in range(self.max_retries):
+            server_addr = self._select_server()
+            
+            if server_addr is None:
+                logger.warning("[%s] No healthy servers available!", self.client_id)
+                await asyncio.sleep(self._backoff_delay(backoff_ms))
+                backoff_ms = min(backoff_ms * 2, self.max_backoff_ms)
+                
+                await self._reprobe_servers()
+                
+                continue
+            
+            try:
+                call_start = time.monotonic()
+                response = await self.process_calls[server_addr](request, timeout=10)
+                
+                self._record_success(server_addr, attempt,
+                                     (time.monotonic() - call_start) * 1000)
+                return response
+            
+            except grpc.RpcError as e:
+                self._record_rpc_error(server_addr, request_id, e.code(), attempt)
+                
+                if attempt < self.max_retries - 1:
+                    await asyncio.sleep(self._backoff_delay(backoff_ms))
+                    backoff_ms = min(backoff_ms * 2, self.max_backoff_ms)
+            
+            except Exception as e:
+                logger.error("[%s] Unexpected error on %s: %s", self.client_id, server_addr, e)
+                self.breakers[server_addr].record_failure()
+                self._mark_server_unhealthy(server_addr)
+                
+                if attempt < self.max_retries - 1:
+                    await asyncio.sleep(self._backoff_delay(backoff_ms))
+                    backoff_ms = min(backoff_ms * 2, self.max_backoff_ms)
+        
+        self._record_failure(request_id)
+        return None
+    
+    async def close(self):
+        """Close all connections."""
+        for addr, channel in self.channels.items():
+            try:
+                await channel.close()
+                logger.info("[%s] Closed connection to %s", self.client_id, addr)
             except:
                 pass
 
 
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def get_shared_client(server_addresses: List[str], **kwargs) -> ResilientSobelClient:
+    """
+    Return the process-wide ResilientSobelClient for these servers.
+    
+    Workers that each built their own client opened one set of channels
+    apiece; sharing a client lets them multiplex over the same HTTP/2
+    connections. Clients are keyed by PID so a forked worker never reuses
+    its parent's channels. kwargs only apply when the client is created.
+    """
+    key = (os.getpid(), tuple(server_addresses))
+    with _shared_clients_lock:
+        client = _shared_clients.get(key)
+        if client is None:
+            client = _shared_clients[key] = ResilientSobelClient(server_addresses, **kwargs)
+    return client
+
+
 if __name__ == '__main__':
     # Test client
     import numpy as np
     
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper())
+    
     servers = ['localhost:50051', 'localhost:50052']
     client = ResilientSobelClient(servers)
     
@@ -5,79 +5,181 @@ Analyze load test results and generate time-series visualizations.
 import json
 import argparse
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # file output only; skip GUI backend probing
 import matplotlib.pyplot as plt
 from datetime import datetime
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Per-request columns kept from the load generator log
+REQUEST_DTYPE = [('timestamp', 'f8'), ('latency_ms', 'f4'), ('success', '?')]
 
 
 def load_test_results(log_file: str) -> dict:
-    """Load test results from JSON log file."""
-    with open(log_file, 'r') as f:
-        return json.load(f)
+    """
+    Load test results from a load generator log file.
+    
+    Reads the NDJSON log (metadata line, one line per request, final
+    metadata/client_stats line) as well as older single-document JSON logs.
+    The per-request entries are returned column-wise in data['requests'] as
+    'timestamp', 'latency_ms' and 'success' arrays, sorted by timestamp.
+    """
+    with open(log_file, 'rb') as f:
+        lines = f.read().splitlines()
+    
+    if not lines:
+        # Generator killed before its header reached disk
+        header = {'metadata': {}}
+    else:
+        try:
+            header = _loads(lines[0])
+        except ValueError:
+            # Pretty-printed single JSON document
+            header = _loads(b'\n'.join(lines))
+    
+    if 'requests' in header:
+        data = header
+        data['requests'] = requests_to_columns(data['requests'])
+    else:
+        data = {'metadata': header['metadata'], 'client_stats': {}}
+        data['requests'] = requests_to_columns(_request_entries(lines[1:], data))
+    _fill_missing_totals(data)
+    return data
 
 
-def calculate_windowed_metrics(requests: List[dict], window_size: float = 1.0):
+def _request_entries(lines: List[bytes], data: dict) -> Iterator[dict]:
+    """Parse NDJSON request lines, merging metadata lines into data."""
+    for i, line in enumerate(lines):
+        try:
+            entry = _loads(line)
+        except ValueError:
+            if i == len(lines) - 1:
+                break  # last line cut off mid-write
+            raise
+        if 'metadata' in entry:
+            data.update(entry)
+        else:
+            yield entry
+
+
+def _fill_missing_totals(data: dict):
+    """
+    Derive run totals from the request columns when the log has no final
+    metadata/client_stats line (generator killed or crashed mid-run).
+    """
+    metadata = data['metadata']
+    stats = data['client_stats']
+    if 'duration_seconds' in metadata and stats:
+        return
+    
+    requests = data['requests']
+    total = len(requests['timestamp'])
+    successful = int(np.count_nonzero(requests['success']))
+    if total:
+        start = metadata.get('start_time', float(requests['timestamp'][0]))
+        end = float(np.max(requests['timestamp'] + requests['latency_ms'] / 1000.0))
+        duration = max(end - start, 0.0)
+    else:
+        duration = 0.0
+    
+    metadata['truncated'] = True
+    metadata.setdefault('duration_seconds', duration)
+    metadata.setdefault('target_rate', 0.0)
+    metadata.setdefault('actual_rate', total / duration if duration > 0 else 0.0)
+    metadata.setdefault('total_requests', total)
+    metadata.setdefault('servers', [])
+    # Retries and failovers are only counted by the client itself
+    stats.setdefault('successful_requests', successful)
+    stats.setdefault('failed_requests', total - successful)
+    stats.setdefault('success_rate', successful / total if total else 0.0)
+    stats.setdefault('retries_count', 'unknown')
+    stats.setdefault('failover_count', 'unknown')
+
+
+def requests_to_columns(entries: Iterable[dict]) -> Dict[str, np.ndarray]:
+    """
+    Convert request log entries to timestamp-sorted column arrays.
+    
+    Entries are written in completion order; concurrent requests can
+    finish out of order.
+    """
+    records = np.fromiter(((r['timestamp'], r['latency_ms'], r['success'])
+                           for r in entries),
+                          dtype=REQUEST_DTYPE)
+    records = records[np.argsort(records['timestamp'], kind='stable')]
+    return {name: np.ascontiguousarray(records[name]) for name in records.dtype.names}
+
+
+def calculate_windowed_metrics(requests: Dict[str, np.ndarray], window_size: float = 1.0):
     """
     Calculate metrics in time windows.
     
+    Requests are assigned to windows in a single bucketing pass rather than
+    rescanning the whole log for every window.
+    
     Args:
-        requests: List of request log entries
+        requests: Request columns from load_test_results
         window_size: Window size in seconds
     
     Returns:
         Dictionary with time-series metrics
     """
-    if not requests:
+    timestamps = requests['timestamp']
+    if not len(timestamps):
         return {}
+    success = requests['success']
     
     # Get start time
-    start_time = requests[0]['timestamp']
-    end_time = requests[-1]['timestamp']
-    duration = end_time - start_time
+    start_time = timestamps[0]
+    duration = timestamps[-1] - start_time
     
-    # Create time windows
+    # Window index of every request
     num_windows = int(duration / window_size) + 1
-    windows = []
+    buckets = ((timestamps - start_time) // window_size).astype(np.intp)
+    np.clip(buckets, 0, num_windows - 1, out=buckets)
+    
+    totals = np.bincount(buckets, minlength=num_windows)
+    ok_buckets = buckets[success]
+    ok_latencies = requests['latency_ms'][success]
+    success_counts = np.bincount(ok_buckets, minlength=num_windows)
+    latency_sums = np.bincount(ok_buckets, weights=ok_latencies, minlength=num_windows)
+    
+    # Sort successful latencies by window, then value; each window's p95 is
+    # then an offset into its contiguous run
+    order = np.lexsort((ok_latencies, ok_buckets))
+    sorted_latencies = ok_latencies[order]
+    offsets = np.cumsum(success_counts) - success_counts
+    has_success = success_counts > 0
+    
+    latency_avg = np.zeros(num_windows)
+    latency_avg[has_success] = latency_sums[has_success] / success_counts[has_success]
+    latency_p95 = np.zeros(num_windows)
+    p95_index = offsets + (success_counts * 0.95).astype(np.intp)
+    latency_p95[has_success] = sorted_latencies[p95_index[has_success]]
     
-    for i in range(num_windows):
-        window_start = start_time + i * window_size
-        window_end = window_start + window_size
-        
-        # Filter requests in this window
-        window_requests = [r for r in requests 
-                          if window_start <= r['timestamp'] < window_end]
-        
-        if not window_requests:
-            windows.append({
-                'time': window_start - start_time,
-                'throughput': 0,
-                'latency_avg': 0,
-                'latency_p95': 0,
-                'success_count': 0,
-                'failure_count': 0
-            })
-            continue
-        
-        # Calculate metrics
-        successful = [r for r in window_requests if r['success']]
-        failed = [r for r in window_requests if not r['success']]
-        
-        latencies = [r['latency_ms'] for r in successful]
-        latencies.sort()
-        
+    windows = []
+    for i, (total, success_count, avg, p95) in enumerate(zip(
+            totals.tolist(), success_counts.tolist(),
+            latency_avg.tolist(), latency_p95.tolist())):
         windows.append({
-            'time': window_start - start_time,
-            'throughput': len(window_requests) / window_size,
-            'latency_avg': np.mean(latencies) if latencies else 0,
-            'latency_p95': latencies[int(len(latencies) * 0.95)] if latencies else 0,
-            'success_count': len(successful),
-            'failure_count': len(failed)
+            'time': i * window_size,
+            'throughput': total / window_size,
+            'latency_avg': avg,
+            'latency_p95': p95,
+            'success_count': success_count,
+            'failure_count': total - success_count
         })
     
     return windows
 
 
-def detect_failure_events(requests: List[dict], window_size: float = 2.0) -> List[dict]:
+def detect_failure_events(requests: Dict[str, np.ndarray], window_size: float = 2.0) -> List[dict]:
     """
     Detect failure events (spikes in errors or latency).
     
@@ -85,11 +187,34 @@ def detect_failure_events(requests: List[dict], window_size: float = 2.0) -> Lis
         List of detected events with timestamps
     """
     windows = calculate_windowed_metrics(requests, window_size)
-    events = []
+    if not windows:
+        return []
+    
+    failure_counts = np.array([w['failure_count'] for w in windows])
+    p95s = np.array([w['latency_p95'] for w in windows])
+    
+    # Baseline for window i: mean of the non-zero p95s in windows i-5..i-1,
+    # as rolling sums/counts over every window at once
+    baseline_sums = np.zeros_like(p95s)
+    baseline_counts = np.zeros_like(p95s)
+    if len(p95s) > 5:
+        kernel = np.ones(5)
+        baseline_sums[5:] = np.convolve(p95s, kernel, mode='valid')[:-1]
+        baseline_counts[5:] = np.convolve(p95s > 0, kernel, mode='valid')[:-1]
+    has_baseline = baseline_counts > 0
+    baselines = np.divide(baseline_sums, baseline_counts,
+                          out=np.zeros_like(p95s), where=has_baseline)
+    
+    error_spikes = failure_counts > 5
+    latency_spikes = has_baseline & (p95s > baselines * 2) & (p95s > 100)
+    latency_spikes[:6] = False
     
-    for i, window in enumerate(windows):
+    events = []
+    for i in np.flatnonzero(error_spikes | latency_spikes).tolist():
+        window = windows[i]
+        
         # Detect error spike
-        if window['failure_count'] > 5:
+        if error_spikes[i]:
             events.append({
                 'time': window['time'],
                 'type': 'error_spike',
@@ -97,31 +222,31 @@ def detect_failure_events(requests: List[dict], window_size: float = 2.0) -> Lis
             })
         
         # Detect latency spike (compare to baseline)
-        if i > 5:
-            baseline_latencies = [w['latency_p95'] for w in windows[max(0,i-5):i] 
-                                 if w['latency_p95'] > 0]
-            if baseline_latencies:
-                baseline_avg = np.mean(baseline_latencies)
-                if window['latency_p95'] > baseline_avg * 2 and window['latency_p95'] > 100:
-                    events.append({
-                        'time': window['time'],
-                        'type': 'latency_spike',
-                        'description': f"p95 latency: {window['latency_p95']:.1f}ms"
-                    })
+        if latency_spikes[i]:
+            events.append({
+                'time': window['time'],
+                'type': 'latency_spike',
+                'description': f"p95 latency: {window['latency_p95']:.1f}ms"
+            })
     
     return events
 
 
-def plot_time_series(windows: List[dict], events: List[dict], output_prefix: str):
+def plot_time_series(windows: List[dict], events: List[dict], output_prefix: str,
+                     throughput_plot: bool = True):
     """Generate time-series plots with failure annotations."""
     
-    times = [w['time'] for w in windows]
-    throughputs = [w['throughput'] for w in windows]
-    latency_avgs = [w['latency_avg'] for w in windows]
-    latency_p95s = [w['latency_p95'] for w in windows]
+    times = np.asarray([w['time'] for w in windows])
+    throughputs = np.asarray([w['throughput'] for w in windows])
+    latency_avgs = np.asarray([w['latency_avg'] for w in windows])
+    latency_p95s = np.asarray([w['latency_p95'] for w in windows])
+    event_times = np.asarray([e['time'] for e in events])
+    # initial=0 keeps an empty log (no windows) plottable
+    max_throughput = throughputs.max(initial=0)
+    max_latency_p95 = latency_p95s.max(initial=0)
     
     # Create figure with two subplots
-    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(14, 10))
+    fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(14, 10), constrained_layout=True)
     
     # Plot 1: Throughput over time
     ax1.plot(times, throughputs, 'b-', linewidth=2, label='Throughput')
@@ -131,10 +256,12 @@ def plot_time_series(windows: List[dict], events: List[dict], output_prefix: str
     ax1.grid(True, alpha=0.3)
     ax1.legend()
     
-    # Add failure annotations to throughput plot
+    # Add failure annotations to throughput plot (one collection for all
+    # event lines, spanning the full axis height like axvline)
+    ax1.vlines(event_times, 0, 1, transform=ax1.get_xaxis_transform(),
+               colors='red', linestyles='--', alpha=0.6)
     for event in events:
-        ax1.axvline(x=event['time'], color='red', linestyle='--', alpha=0.6)
-        ax1.text(event['time'], max(throughputs) * 0.9, 
+        ax1.text(event['time'], max_throughput * 0.9, 
                 event['type'].replace('_', ' ').title(),
                 rotation=90, verticalalignment='bottom',
                 fontsize=9, color='red')
@@ -149,38 +276,41 @@ def plot_time_series(windows: List[dict], events: List[dict], output_prefix: str
     ax2.legend()
     
     # Add failure annotations to latency plot
+    ax2.vlines(event_times, 0, 1, transform=ax2.get_xaxis_transform(),
+               colors='red', linestyles='--', alpha=0.6)
     for event in events:
-        ax2.axvline(x=event['time'], color='red', linestyle='--', alpha=0.6)
-        ax2.text(event['time'], max(latency_p95s) * 0.9,
+        ax2.text(event['time'], max_latency_p95 * 0.9,
                 event['description'],
                 rotation=90, verticalalignment='bottom',
                 fontsize=9, color='red')
     
-    plt.tight_layout()
-    plt.savefig(f'{output_prefix}_timeseries.png', dpi=300, bbox_inches='tight')
+    fig.savefig(f'{output_prefix}_timeseries.png', dpi=300)
     print(f"Saved: {output_prefix}_timeseries.png")
-    plt.close()
+    plt.close(fig)
+    
+    if not throughput_plot:
+        return
     
     # Create separate focused plots
-    fig, ax = plt.subplots(figsize=(12, 6))
+    fig, ax = plt.subplots(figsize=(12, 6), constrained_layout=True)
     ax.plot(times, throughputs, 'b-', linewidth=2.5)
     ax.set_xlabel('Time (seconds)', fontsize=13)
     ax.set_ylabel('Throughput (requests/second)', fontsize=13)
     ax.set_title('System Throughput with Failure Events', fontsize=15, fontweight='bold')
     ax.grid(True, alpha=0.3)
     
+    ax.vlines(event_times, 0, 1, transform=ax.get_xaxis_transform(),
+              colors='red', linestyles='--', linewidth=2, alpha=0.7)
     for event in events:
-        ax.axvline(x=event['time'], color='red', linestyle='--', linewidth=2, alpha=0.7)
         ax.annotate(f"Failure: {event['type']}", 
-                   xy=(event['time'], max(throughputs) * 0.8),
-                   xytext=(event['time'] + 2, max(throughputs) * 0.85),
+                   xy=(event['time'], max_throughput * 0.8),
+                   xytext=(event['time'] + 2, max_throughput * 0.85),
                    arrowprops=dict(arrowstyle='->', color='red', lw=1.5),
                    fontsize=10, color='red', fontweight='bold')
     
-    plt.tight_layout()
-    plt.savefig(f'{output_prefix}_throughput.png', dpi=300, bbox_inches='tight')
+    fig.savefig(f'{output_prefix}_throughput.png', dpi=300)
     print(f"Saved: {output_prefix}_throughput.png")
-    plt.close()
+    plt.close(fig)
 
 
 def calculate_recovery_time(windows: List[dict], failure_event_time: float,
@@ -233,7 +363,11 @@ def generate_summary_report(data: dict, windows: List[dict], events: List[dict],
         f.write(f"  Target Rate: {metadata['target_rate']:.2f} req/sec\n")
         f.write(f"  Actual Rate: {metadata['actual_rate']:.2f} req/sec\n")
         f.write(f"  Total Requests: {metadata['total_requests']}\n")
-        f.write(f"  Servers: {', '.join(metadata['servers'])}\n\n")
+        f.write(f"  Servers: {', '.join(metadata['servers'])}\n")
+        if metadata.get('truncated'):
+            f.write("  Note: log has no final summary line; "
+                    "totals derived from request entries\n")
+        f.write("\n")
         
         # Client stats
         stats = data['client_stats']
@@ -245,17 +379,19 @@ def generate_summary_report(data: dict, windows: List[dict], events: List[dict],
         f.write(f"  Failover Count: {stats['failover_count']}\n\n")
         
         # Latency analysis
-        successful_requests = [r for r in data['requests'] if r['success']]
-        latencies = [r['latency_ms'] for r in successful_requests]
-        latencies.sort()
+        requests = data['requests']
+        latencies = requests['latency_ms'][requests['success']]
         
-        if latencies:
+        if len(latencies):
+            # One O(N) partition places all three percentile ranks
+            ranks = [int(len(latencies) * q) for q in (0.50, 0.95, 0.99)]
+            p50, p95, p99 = np.partition(latencies, ranks)[ranks]
             f.write("Latency Distribution:\n")
-            f.write(f"  Min: {min(latencies):.2f} ms\n")
-            f.write(f"  p50 (Median): {latencies[int(len(latencies)*0.50)]:.2f} ms\n")
-            f.write(f"  p95: {latencies[int(len(latencies)*0.95)]:.2f} ms\n")
-            f.write(f"  p99: {latencies[int(len(latencies)*0.99)]:.2f} ms\n")
-            f.write(f"  Max: {max(latencies):.2f} ms\n")
+            f.write(f"  Min: {latencies.min():.2f} ms\n")
+            f.write(f"  p50 (Median): {p50:.2f} ms\n")
+            f.write(f"  p95: {p95:.2f} ms\n")
+            f.write(f"  p99: {p99:.2f} ms\n")
+            f.write(f"  Max: {latencies.max():.2f} ms\n")
             f.write(f"  Average: {np.mean(latencies):.2f} ms\n\n")
         
         # Detected events
@@ -290,6 +426,8 @@ def main():
                        help='Output file prefix (default: analysis)')
     parser.add_argument('--window', type=float, default=1.0,
                        help='Time window for metrics (seconds, default: 1.0)')
+    parser.add_argument('--no-throughput-plot', action='store_true',
+                       help='Only write the combined time-series plot')
     
     args = parser.parse_args()
     
@@ -304,7 +442,8 @@ def main():
     print(f"  Found {len(events)} failure events")
     
     print("Generating plots...")
-    plot_time_series(windows, events, args.output)
+    plot_time_series(windows, events, args.output,
+                     throughput_plot=not args.no_throughput_plot)
     
     print("Generating summary report...")
     generate_summary_report(data, windows, events, f'{args.output}_report.txt')
@@ -8,18 +8,64 @@ import grpc
 from concurrent import futures
 import time
 import argparse
+import atexit
+import logging
+import logging.handlers
+import multiprocessing
+import queue
 import signal
 import sys
 import os
-from collections import deque
+from itertools import count
 import threading
+import numpy as np
+from hdrh.histogram import HdrHistogram
 
 # Add proto directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 import sobel_service_pb2
 import sobel_service_pb2_grpc
-from server.sobel_worker import process_image_bytes
+from server.sobel_worker import limit_numba_threads, process_image_bytes, warmup
+
+# Accept large images and the clients' 10 s keepalive pings (the server
+# otherwise answers frequent idle pings with GOAWAY)
+MAX_MESSAGE_BYTES = 64 << 20
+SERVER_OPTIONS = [
+    ('grpc.max_send_message_length', MAX_MESSAGE_BYTES),
+    ('grpc.max_receive_message_length', MAX_MESSAGE_BYTES),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.min_recv_ping_interval_without_data_ms', 5000),
+    # Several processes may bind the same port (see serve_processes)
+    ('grpc.so_reuseport', 1),
+]
+
+# The Sobel backends release the GIL, so worker threads run in parallel
+MAX_WORKERS = int(os.environ.get('SOBEL_WORKERS', 2 * (os.cpu_count() or 1)))
+
+# Metric counters are split into per-thread shards so worker threads never
+# contend on a lock; readers sum the shards.  One shard per worker thread,
+# so each worker owns its slot outright.
+N_SHARDS = MAX_WORKERS
+
+# Each shard's counters sit in their own 64-byte row (8 x int64), so a
+# worker's increments and a HealthCheck read never share a cache line
+CACHE_LINE_INT64S = 8
+TOTAL, SUCCESS, FAILURE = 0, 1, 2
+
+logger = logging.getLogger(__name__)
+
+# Processing-time histograms record microseconds from 1 us to 60 s at three
+# significant digits and cover every request since startup
+HIST_MAX_US = 60_000_000
+HIST_DIGITS = 3
+
+
+def _cache_aligned_zeros(rows: int, cols: int) -> np.ndarray:
+    """Zeroed (rows, cols) int64 array whose rows start on 64-byte boundaries."""
+    buf = np.zeros(rows * cols + CACHE_LINE_INT64S, dtype=np.int64)
+    offset = (-buf.ctypes.data % 64) // buf.itemsize
+    return buf[offset:offset + rows * cols].reshape(rows, cols)
 
 
 class SobelServicer(sobel_service_pb2_grpc.SobelServiceServicer):
@@ -28,21 +74,54 @@ class SobelServicer(sobel_service_pb2_grpc.SobelServiceServicer):
     def __init__(self, server_id: str):
         self.server_id = server_id
         self.start_time = time.time()
-        self.total_requests = 0
-        self.successful_requests = 0
-        self.failed_requests = 0
-        self.processing_times = deque(maxlen=1000)  # Keep last 1000
-        self.lock = threading.Lock()
+        self._counters = _cache_aligned_zeros(N_SHARDS, CACHE_LINE_INT64S)
+        self._histograms = [HdrHistogram(1, HIST_MAX_US, HIST_DIGITS)
+                            for _ in range(N_SHARDS)]
+        self._shard_ids = count()
+        self._local = threading.local()
+        
+        # Up to MAX_WORKERS requests run Numba kernels at once; split the
+        # cores between them instead of giving each a full thread team
+        limit_numba_threads(MAX_WORKERS)
+        
+        # Compile the Sobel kernel now rather than on the first request
+        warmup()
         
         print(f"[{self.server_id}] Server initialized")
     
+    def _shard(self) -> int:
+        """Return the calling thread's counter shard, assigning one on first use."""
+        try:
+            return self._local.shard
+        except AttributeError:
+            # next() on itertools.count is atomic under the GIL
+            shard = self._local.shard = next(self._shard_ids) % N_SHARDS
+            return shard
+    
+    def _counter_totals(self) -> tuple:
+        """Sum the shards into (total, successful, failed) request counts."""
+        totals = self._counters.sum(axis=0)
+        return int(totals[TOTAL]), int(totals[SUCCESS]), int(totals[FAILURE])
+    
+    @property
+    def total_requests(self) -> int:
+        return self._counter_totals()[0]
+    
+    @property
+    def successful_requests(self) -> int:
+        return self._counter_totals()[1]
+    
+    @property
+    def failed_requests(self) -> int:
+        return self._counter_totals()[2]
+    
     def ProcessImage(self, request, context):
         """Process an image with Sobel edge detection."""
         start_time = time.time()
+        shard = self._shard()
         
         try:
-            with self.lock:
-                self.total_requests += 1
+            self._counters[shard, TOTAL] += 1
             
             # Process the image
             result_bytes = process_image_bytes(
@@ -54,9 +133,9 @@ class SobelServicer(sobel_service_pb2_grpc.SobelServiceServicer):
             # Calculate processing time
             processing_time_ms = (time.time() - start_time) * 1000
             
-            with self.lock:
-                self.successful_requests += 1
-                self.processing_times.append(processing_time_ms)
+            self._counters[shard, SUCCESS] += 1
+            self._histograms[shard].record_value(
+                min(int(processing_time_ms * 1000), HIST_MAX_US))
             
             # Create response
             response = sobel_service_pb2.ImageResponse(
@@ -69,16 +148,16 @@ class SobelServicer(sobel_service_pb2_grpc.SobelServiceServicer):
                 server_id=self.server_id
             )
             
-            print(f"[{self.server_id}] Processed request {request.request_id} "
-                  f"({request.width}x{request.height}) in {processing_time_ms:.2f}ms")
+            logger.debug("[%s] Processed request %s (%dx%d) in %.2fms",
+                         self.server_id, request.request_id,
+                         request.width, request.height, processing_time_ms)
             
             return response
             
         except Exception as e:
-            with self.lock:
-                self.failed_requests += 1
+            self._counters[shard, FAILURE] += 1
             
-            print(f"[{self.server_id}] Error processing request: {e}")
+            logger.error("[%s] Error processing request: %s", self.server_id, e)
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(f"Processing error: {str(e)}")
             return sobel_service_pb2.ImageResponse()
@@ -86,29 +165,35 @@ class SobelServicer(sobel_service_pb2_grpc.SobelServiceServicer):
     def HealthCheck(self, request, context):
         """Health check endpoint."""
         uptime = int(time.time() - self.start_time)
+        total, successful, failed = self._counter_totals()
         
         return sobel_service_pb2.HealthResponse(
             healthy=True,
             server_id=self.server_id,
-            load=self.total_requests - self.successful_requests - self.failed_requests,
+            load=total - successful - failed,
             uptime_seconds=uptime
         )
     
     def GetMetrics(self, request, context):
         """Return server metrics."""
-        with self.lock:
-            avg_time = sum(self.processing_times) / len(self.processing_times) if self.processing_times else 0
-            sorted_times = sorted(self.processing_times)
-            p95_time = sorted_times[int(len(sorted_times) * 0.95)] if sorted_times else 0
-            p99_time = sorted_times[int(len(sorted_times) * 0.99)] if sorted_times else 0
+        merged = HdrHistogram(1, HIST_MAX_US, HIST_DIGITS)
+        for histogram in self._histograms:
+            merged.add(histogram)
+        if merged.get_total_count():
+            avg_time = merged.get_mean_value() / 1000
+            p95_time = merged.get_value_at_percentile(95) / 1000
+            p99_time = merged.get_value_at_percentile(99) / 1000
+        else:
+            avg_time = p95_time = p99_time = 0
         
         uptime = int(time.time() - self.start_time)
+        total, successful, failed = self._counter_totals()
         
         return sobel_service_pb2.MetricsResponse(
             server_id=self.server_id,
-            total_requests=self.total_requests,
-            successful_requests=self.successful_requests,
-            failed_requests=self.failed_requests,
+            total_requests=total,
+            successful_requests=successful,
+            failed_requests=failed,
             avg_processing_time_ms=avg_time,
             p95_processing_time_ms=p95_time,
             p99_processing_time_ms=p99_time,
@@ -116,9 +201,30 @@ class SobelServicer(sobel_service_pb2_grpc.SobelServiceServicer):
         )
 
 
+def configure_logging():
+    """
+    Log at LOG_LEVEL (default WARNING) through a queue.
+    
+    Worker threads only enqueue records; a listener thread formats and
+    writes them, so request threads never wait on stderr.
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    
+    root = logging.getLogger()
+    root.setLevel(os.environ.get('LOG_LEVEL', 'WARNING').upper())
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    atexit.register(listener.stop)
+
+
 def serve(port: int, server_id: str):
     """Start the gRPC server."""
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    configure_logging()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=MAX_WORKERS),
+                         options=SERVER_OPTIONS)
     servicer = SobelServicer(server_id)
     sobel_service_pb2_grpc.add_SobelServiceServicer_to_server(servicer, server)
     
@@ -144,11 +250,46 @@ def serve(port: int, server_id: str):
         server.stop(0)
 
 
+def serve_processes(port: int, server_id: str, processes: int):
+    """
+    Run several server processes on the same port.
+    
+    Each process binds with SO_REUSEPORT and the kernel spreads incoming
+    connections across them. Processes are named <server_id>.<n>, and
+    SIGINT/SIGTERM to this parent stops them all.
+    """
+    # Split the cores between the processes' Numba thread pools (read when
+    # each spawned child imports numba)
+    os.environ.setdefault('NUMBA_NUM_THREADS',
+                          str(max(1, (os.cpu_count() or 1) // processes)))
+    
+    ctx = multiprocessing.get_context('spawn')
+    children = [ctx.Process(target=serve, args=(port, f'{server_id}.{i}'))
+                for i in range(processes)]
+    for child in children:
+        child.start()
+    
+    def signal_handler(sig, frame):
+        for child in children:
+            child.terminate()
+    
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    
+    for child in children:
+        child.join()
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Sobel gRPC Server')
     parser.add_argument('--port', type=int, required=True, help='Port to listen on')
     parser.add_argument('--id', type=str, required=True, help='Server ID (e.g., server-1)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Server processes sharing the port (default: 1)')
     
     args = parser.parse_args()
     
-    serve(args.port, args.id)
+    if args.processes > 1:
+        serve_processes(args.port, args.id, args.processes)
+    else:
+        serve(args.port, args.id)
@@ -11,7 +11,7 @@ import sys
 import os
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-from client.sobel_client import ResilientSobelClient
+from client.sobel_client import get_shared_client
 
 
 class SobelProcessor(MapFunction):
@@ -21,8 +21,8 @@ class SobelProcessor(MapFunction):
         self.client = None
     
     def open(self, runtime_context):
-        """Initialize gRPC client."""
-        self.client = ResilientSobelClient(
+        """Initialize gRPC client (shared by the subtasks in this process)."""
+        self.client = get_shared_client(
             ['localhost:50051', 'localhost:50052'],
             max_retries=3
         )
@@ -49,8 +49,9 @@ class SobelProcessor(MapFunction):
     
     def close(self):
         """Cleanup."""
-        if self.client:
-            self.client.close()
+        # The shared client may still be serving other subtasks, so only
+        # drop the reference; its channels close with the process
+        self.client = None
 
 
 def main():
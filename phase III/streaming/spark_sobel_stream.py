@@ -11,20 +11,15 @@ import sys
 import os
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-from client.sobel_client import ResilientSobelClient
+from client.sobel_client import get_shared_client
 
 
-# Initialize gRPC client (shared across workers)
-_client = None
-
 def get_client():
-    global _client
-    if _client is None:
-        _client = ResilientSobelClient(
-            ['localhost:50051', 'localhost:50052'],
-            max_retries=3
-        )
-    return _client
+    """gRPC client shared by every task in this worker process."""
+    return get_shared_client(
+        ['localhost:50051', 'localhost:50052'],
+        max_retries=3
+    )
 
 
 def process_image_spark(image_bytes, width, height, request_id):